@@ -22,9 +22,9 @@
 ## along with this program; if not, see <http://www.gnu.org/licenses/>.
 ##
 
-import re
+import sys
 import sigrokdecode as srd
-from common.srdhelper import bcd2int, SrdIntEnum
+from common.srdhelper import SrdIntEnum
 
 days_of_week = {'Monday': ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'),
                 'Sunday': ('Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'),
@@ -55,6 +55,93 @@ blocks = (
     'Date Time', 'Alarm1', 'Alarm2', 'Temperature',
 )
 
+DS3231_I2C_ADDRESS = 0x68
+
+# packed BCD byte -> decimal value (same result as bcd2int() for every byte)
+bcd2dec = bytes((i >> 4) * 10 + (i & 0x0f) for i in range(256))
+
+def masked_bcd(mask):
+    # Table of bcd2dec[b & mask], indexed directly by the register byte b.
+    return bytes(i & mask for i in range(256)).translate(bcd2dec)
+
+bcd_7f, bcd_3f, bcd_1f, bcd_07 = [masked_bcd(m) for m in (0x7f, 0x3f, 0x1f, 0x07)]
+
+def value_labels(fmts):
+    # Pre-format the label list of a BCD field for every value it can take.
+    # Interned, so equal labels in different tables are one object.
+    return tuple([sys.intern(f % v if '%' in f else f) for f in fmts]
+                 for v in range(max(bcd2dec) + 1))
+
+second_labels = value_labels(('Second: %d', 'Sec: %d', 'S: %d', 'S'))
+minute_labels = value_labels(('Minute: %d', 'Min: %d', 'M: %d', 'M'))
+hour_labels = value_labels(('Hour: %d', 'H: %d', 'H'))
+date_labels = value_labels(('Date: %d', 'D: %d', 'D'))
+alarm_date_labels = value_labels(('Date / Day: %d', 'D: %d', 'D'))
+month_labels = value_labels(('Month: %d', 'Mon: %d', 'M: %d', 'M'))
+year_labels = tuple([sys.intern('Year: %d' % (2000 + y)), sys.intern('Y: %d' % y), 'Y']
+                    for y in range(max(bcd2dec) + 1))
+
+# first registers of the date/time, alarm1, alarm2 and temperature blocks
+block_start_regs = (0x00, 0x07, 0x0b, 0x11)
+
+# next register pointer after an access (auto-increment, 0x12 wraps to 0)
+reg_inc = tuple((i + 1) % 0x13 for i in range(0x13))
+
+# '/' and ' ' in register/bit/block names become '_' in annotation ids
+id_chars = str.maketrans('/ ', '__')
+
+def regs_and_bits_and_blocks():
+    l = []
+    for prefix, suffix, names in (('reg_', ' register', regs),
+            ('bit_', ' bit', bits), ('block_', ' block', blocks)):
+        l += [(prefix + n.translate(id_chars).lower(), n + suffix) for n in names]
+    return tuple(l)
+
+ann_regs_bits_blocks = regs_and_bits_and_blocks()
+Ann = SrdIntEnum.from_list('Ann',
+    [i.upper() for i, d in ann_regs_bits_blocks] + ['WARNING'])
+
+# Fully static annotation payloads, shared by all emissions (never modified).
+payload_reserved = [Ann.BIT_RESERVED, ['Reserved bit', 'Reserved', 'Rsvd', 'R']]
+payload_12h = [Ann.BIT_12_24_HOURS, ['12-hour mode', '12h mode', '12h']]
+payload_24h = [Ann.BIT_12_24_HOURS, ['24-hour mode', '24h mode', '24h']]
+payload_ampm = ([Ann.BIT_AM_PM, ['AM', 'A']], [Ann.BIT_AM_PM, ['PM', 'P']])
+
+def flag(bit, ann, fmts, words=('dis', 'en')):
+    # Payloads of a single-bit flag, indexed by the bit value. The label
+    # formats may use %(v)d (0/1) and %(w)s (the word for that value).
+    return (bit, tuple([ann, [sys.intern(f % {'v': v, 'w': words[v]})
+                              for f in fmts]] for v in (0, 1)))
+
+# Control register flags above (bits 7-5) and below (bits 2-0) RATE
+control_flags_hi = (
+    flag(7, Ann.BIT__EOSC, ('Enable oscillator: %(v)d', 'enab osc: %(v)d',
+        'EO: %(v)d', 'EO')),
+    flag(6, Ann.BIT_BBSQWE, ('Battery backed square wave %(w)sabled',
+        'BBSQWE: %(w)sabled', 'SQWE: %(v)d', 'S: %(v)d', 'S')),
+    flag(5, Ann.BIT_CONV, ('Forced temperature conversion: %(v)d',
+        'frc tconv: %(v)d', 'FC: %(v)d', 'FC')),
+)
+
+control_flags_lo = (
+    flag(2, Ann.BIT_INTCN, ('Int/SQW pin: %(w)s', 'Int on pin: %(v)d',
+        'IP: %(v)d', 'IP'), ('square wave', 'alarm interrupt')),
+    flag(1, Ann.BIT_A2IE, ('Alarm2 interrupt %(w)sabled', 'Al2 INT %(w)sabled',
+        'Al2 INT: %(v)d', 'A2I: %(v)d', 'A2I')),
+    flag(0, Ann.BIT_A1IE, ('Alarm1 interrupt %(w)sabled', 'Al1 INT %(w)sabled',
+        'Al1 INT: %(v)d', 'A1I: %(v)d', 'A1I')),
+)
+
+status_flags = (
+    flag(7, Ann.BIT_OSF, ('Oscillator stop flag: %(v)d', 'Osc stop: %(v)d',
+        'OS: %(v)d', 'OS')),
+    flag(3, Ann.BIT_EN32KHZ, ('Enable 32kHz output: %(v)d', 'En 32k out: %(v)d',
+        '32k: %(v)d', '32k')),
+    flag(2, Ann.BIT_BSY, ('Busy TXCO: %(v)d', 'TXCO: %(v)d', 'TX: %(v)d', 'TX')),
+    flag(1, Ann.BIT_A2F, ('Alarm2 flag: %(v)d', 'Al2 flg: %(v)d', 'A2F: %(v)d', 'A2')),
+    flag(0, Ann.BIT_A1F, ('Alarm1 flag: %(v)d', 'Al1 flg: %(v)d', 'A1F: %(v)d', 'A1')),
+)
+
 # used only for DS3231(SN), bits reserved for DS3231M (always 1Hz)
 rates = {
     0b00: '1Hz',
@@ -63,19 +150,60 @@ rates = {
     0b11: '8192Hz',
 }
 
-DS3231_I2C_ADDRESS = 0x68
+# RATE payloads, indexed by bits 4-3 of the control register
+rate_payloads = tuple([Ann.BIT_RATE, ['Square wave output rate: %s' % r,
+    'Square wave rate: %s' % r, 'SQW rate: %s' % r, 'Rate: %s' % r,
+    'RA: %s' % r, 'RA', 'R']] for i, r in sorted(rates.items()))
+
+# Block annotation texts, each a single format of the direction ('Read' or
+# 'Wrote') and the decoded values.
+fmt_date_time = '%s Date / time: %s, %02d.%02d.%4d %02d:%02d:%02d%s'.__mod__
+fmt_alarm1 = '%s Alarm1: %s'.__mod__
+fmt_alarm2 = '%s Alarm2: %s'.__mod__
+fmt_temperature = '%s block data: Temperature: %.2f'.__mod__
+
+# Alarm block descriptions, keyed by the alarm mask bits A1M1..A1M4
+# (A2M2..A2M4 for alarm2) packed MSB first.
+alarm1_formats = {
+    0b1111: lambda s, m, h, ampm, day: 'every second',
+    0b0111: lambda s, m, h, ampm, day: 'every minute, second=%02d' % s,
+    0b0011: lambda s, m, h, ampm, day: 'every hour, mm:ss=%02d:%02d' % (m, s),
+    0b0001: lambda s, m, h, ampm, day: 'daily, hh:mm:ss=%02d:%02d:%02d%s' % (h, m, s, ampm),
+    0b0000: lambda s, m, h, ampm, day: '%s, %02d:%02d:%02d' % (day, h, m, s),
+}
 
-def regs_and_bits_and_blocks():
-    l = [('reg_' + re.sub('\\/| ', '_', r).lower(), r + ' register') for r in regs]
-    l += [('bit_' + re.sub('\\/| ', '_', b).lower(), b + ' bit') for b in bits]
-    l += [('block_' + re.sub('\\/| ', '_', bl).lower(), bl + ' block') for bl in blocks]
-    return tuple(l)
+alarm2_formats = {
+    0b111: lambda m, h, ampm, day: 'every minute',
+    0b011: lambda m, h, ampm, day: 'every hour, minute=%02d' % m,
+    0b001: lambda m, h, ampm, day: 'every day, hh:mm=%02d:%02d%s' % (h, m, ampm),
+    0b000: lambda m, h, ampm, day: 'every %s, hh:mm=%02d:%02d' % (day, h, m),
+}
 
-a = ['REG_' + re.sub('\\/| ', '_',r).upper() for r in regs] + \
-    ['BIT_' + re.sub('\\/| ', '_', b).upper() for b in bits] + \
-    ['BLOCK_' + re.sub('\\/| ', '_', bl).upper() for bl in blocks] + \
-    ['WARNING']
-Ann = SrdIntEnum.from_list('Ann', a)    
+def invalid_alarm(*args):
+    return 'invalid setting'  #FIXME: print warning
+
+# register annotations, indexed by register address
+reg_payloads = (
+    [Ann.REG_SECONDS, ['Seconds', 'Sec', 'S']],
+    [Ann.REG_MINUTES, ['Minutes', 'Min', 'M']],
+    [Ann.REG_HOURS, ['Hours', 'H']],
+    [Ann.REG_DAY, ['Day of week', 'Day', 'D']],
+    [Ann.REG_DATE, ['Date', 'D']],
+    [Ann.REG_MONTH, ['Month', 'Mon', 'M']],
+    [Ann.REG_YEAR, ['Year', 'Y']],
+    [Ann.REG_ALARM1_SECONDS, ['Alarm1 Seconds', 'Al1 Sec', 'A1S']],
+    [Ann.REG_ALARM1_MINUTES, ['Alarm1 Minutes', 'Al1 Min', 'A1M']],
+    [Ann.REG_ALARM1_HOURS, ['Alarm1 Hours', 'Al1 Hr', 'A1H']],
+    [Ann.REG_ALARM1_DAY_DATE, ['Alarm1 Date or Day of week', 'Al1 Day / DOW', 'A1DD']],
+    [Ann.REG_ALARM2_MINUTES, ['Alarm2 Minutes', 'Al2 Min', 'A2M']],
+    [Ann.REG_ALARM2_HOURS, ['Alarm2 Hours', 'Al2 Hr', 'A2H']],
+    [Ann.REG_ALARM2_DAY_DATE, ['Alarm2 Date or Day of week', 'Al2 Day / DOW', 'A2DD']],
+    [Ann.REG_CONTROL, ['Control', 'Ctrl', 'C']],
+    [Ann.REG_CONTROL_STATUS, ['Control / Status', 'Ctrl/Stat', 'C/S']],
+    [Ann.REG_AGING_OFFSET, ['Aging offset', 'Aging', 'A']],
+    [Ann.REG_TEMPERATURE_MSB, ['Temperature MSB', 'tm', 't']],
+    [Ann.REG_TEMPERATURE_LSB, ['Temperature LSB', 'tl', 't']],
+)
 
 class Decoder(srd.Decoder):
     api_version = 3
@@ -99,7 +227,7 @@ class Decoder(srd.Decoder):
          'values': ('Monday', 'Sunday', 'Saturday')
         },
     )
-    annotations =  regs_and_bits_and_blocks() + (
+    annotations =  ann_regs_bits_blocks + (
         ('warning', 'Warning'),
     )
     annotation_rows = (
@@ -114,7 +242,8 @@ class Decoder(srd.Decoder):
 
     def reset(self):
         self.state = 'IDLE'
-        self.bits = []
+        self.ss_bits = []
+        self.es_bits = []
         #date time
         self.seconds = -1
         self.minutes = -1
@@ -141,326 +270,244 @@ class Decoder(srd.Decoder):
         self.tempMSB = -1
         #regs
         self.startreg = -1
-        self.inblock = -1
-        self.blockmode = ''        
+        self.nextreg = -1
+        self.blockmode = ''
         
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
         self.reg = self.options['regptr']
+        self.dow = days_of_week[self.options['fdw']]
+        # weekday payloads, indexed by the day register value (0-7)
+        self.day_payloads = tuple([Ann.BIT_DAY, ['Weekday: %s' % ws,
+            'WD: %s' % ws, 'WD', 'W']] for ws in self.dow[-1:] + self.dow)
+        self.alarm_day_payloads = tuple([Ann.BIT_DAY, ['Weekday: %s' % ws,
+            'WD: %d' % w, 'WD', 'W']] for w, ws in enumerate(self.dow[-1:] + self.dow))
+        self.fsm = {
+            ('IDLE', 'START'): self.on_start,
+            ('GET SLAVE ADDR', 'ADDRESS WRITE'): self.on_address_write,
+            ('GET SLAVE ADDR', 'ADDRESS READ'): self.on_address_read,
+            ('GET REG ADDR', 'DATA WRITE'): self.on_reg_addr,
+            ('GET REG ADDR', 'STOP'): self.on_stop,
+            # If we see a Repeated Start here, it's an RTC read.
+            ('WRITE RTC REGS', 'START REPEAT'): self.on_start,
+            # Otherwise: Get data bytes until a STOP condition occurs.
+            ('WRITE RTC REGS', 'DATA WRITE'): self.on_data_write,
+            ('WRITE RTC REGS', 'STOP'): self.on_stop,
+            ('READ RTC REGS', 'DATA READ'): self.on_data_read,
+            ('READ RTC REGS', 'STOP'): self.on_stop,
+        }
+        # Specialize for the options, which are fixed for the session.
+        handlers = [getattr(self, 'handle_reg_0x%02x' % i) for i in range(0x13)]
+        if self.options['subtype'] == 'M':
+            handlers[0x0e] = self.handle_reg_0x0e_m
+        self.handlers = tuple(handlers)
 
     def putd(self, bit1, bit2, data):
-        self.put(self.bits[bit1][1], self.bits[bit2][2], self.out_ann, data)
-
-    def putr(self, bit):
-        self.put(self.bits[bit][1], self.bits[bit][2], self.out_ann,
-                 [Ann.BIT_RESERVED, ['Reserved bit', 'Reserved', 'Rsvd', 'R']])
-
-    def handle_reg_0x00(self, b, rw): # Seconds (0-59)
-        self.putd(7, 0, [Ann.REG_SECONDS, ['Seconds', 'Sec', 'S']])
-        s = self.seconds = bcd2int(b & 0x7f)
-        self.putr(7)
-        self.putd(6, 0, [Ann.BIT_SECONDS, ['Second: %d' % s, 'Sec: %d' % s, 'S: %d' % s, 'S']])
-        #block
-        self.startreg = self.ss
-        self.inblock = 0
-        self.blockmode = rw
-        
-    def handle_reg_0x01(self, b, rw): # Minutes (0-59)
-        self.putd(7, 0, [Ann.REG_MINUTES, ['Minutes', 'Min', 'M']])
-        self.putr(7)
-        m = self.minutes = bcd2int(b & 0x7f)
-        self.putd(6, 0, [Ann.BIT_MINUTES, ['Minute: %d' % m, 'Min: %d' % m, 'M: %d' % m, 'M']])
-        self.inblock = 1 if self.inblock == 0 and self.blockmode == rw else -1
-
-    def handle_reg_0x02(self, b, rw): # Hours (1-12+AM/PM or 0-23)
-        self.putd(7, 0, [Ann.REG_HOURS, ['Hours', 'H']])
-        self.putr(7)
-        if (b & (1 << 6)):
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['12-hour mode', '12h mode', '12h']])
-            self.ampm = 'PM' if (b & (1 << 5)) else 'AM'
-            self.putd(5, 5, [Ann.BIT_AM_PM, [self.ampm, self.ampm[0]]])
-            self.hours = bcd2int(b & 0x1f)
-            self.putd(4, 0, [Ann.BIT_HOURS, ['Hour: %d' % self.hours, 'H: %d' % self.hours, 'H']])
+        self.put(self.ss_bits[bit1], self.es_bits[bit2], self.out_ann, data)
+
+    def putr(self, bit1, bit2):
+        # One annotation spanning a run of adjacent reserved bits.
+        self.put(self.ss_bits[bit1], self.es_bits[bit2], self.out_ann,
+                 payload_reserved)
+
+    def put_hours(self, b):
+        # Bits 6-0 of the hours registers: 12/24 hour mode, AM/PM, hours.
+        # Returns the hours and the AM/PM suffix ('' in 24-hour mode).
+        put, out_ann, ss, es = self.put, self.out_ann, self.ss_bits, self.es_bits
+        if b & 0x40:
+            pm = (b >> 5) & 1
+            ampm = ('AM', 'PM')[pm]
+            hours = bcd_1f[b]
+            put(ss[6], es[6], out_ann, payload_12h)
+            put(ss[5], es[5], out_ann, payload_ampm[pm])
+            put(ss[4], es[0], out_ann, [Ann.BIT_HOURS, hour_labels[hours]])
         else:
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['24-hour mode', '24h mode', '24h']])
-            self.ampm = ''
-            self.hours = bcd2int(b & 0x3f)
-            self.putd(5, 0, [Ann.BIT_HOURS, ['Hour: %d' % self.hours, 'H: %d' % self.hours, 'H']])
-        self.inblock = 2 if self.inblock == 1 and self.blockmode == rw else -1    
-
-    def handle_reg_0x03(self, b, rw): # Day / day of week (1-7)
-        self.putd(7, 0, [Ann.REG_DAY, ['Day of week', 'Day', 'D']])
-        for i in (7, 6, 5, 4, 3):
-            self.putr(i)
-        self.days = bcd2int(b & 0x07)
-        ws = days_of_week[self.options['fdw']][self.days - 1]
-        self.putd(2, 0, [Ann.BIT_DAY, ['Weekday: %s' % ws, 'WD: %s' % ws, 'WD', 'W']])
-        self.inblock = 3 if self.inblock == 2 and self.blockmode == rw else -1
-
-    def handle_reg_0x04(self, b, rw): # Date (1-31)
-        self.putd(7, 0, [Ann.REG_DATE, ['Date', 'D']])
-        for i in (7, 6):
-            self.putr(i)
-        d = self.date = bcd2int(b & 0x3f)
-        self.putd(5, 0, [Ann.BIT_DATE, ['Date: %d' % d, 'D: %d' % d, 'D']])
-        self.inblock = 4 if self.inblock == 3 and self.blockmode == rw else -1
-
-    def handle_reg_0x05(self, b, rw): # Month (1-12)
-        self.putd(7, 0, [Ann.REG_MONTH, ['Month', 'Mon', 'M']])
+            ampm = ''
+            hours = bcd_3f[b]
+            put(ss[6], es[6], out_ann, payload_24h)
+            put(ss[5], es[0], out_ann, [Ann.BIT_HOURS, hour_labels[hours]])
+        return hours, ampm
+
+    def handle_reg_0x00(self, b, rw, chain): # Seconds (0-59)
+        s = self.seconds = bcd_7f[b]
+        self.putr(7, 7)
+        self.putd(6, 0, [Ann.BIT_SECONDS, second_labels[s]])
+
+    def handle_reg_0x01(self, b, rw, chain): # Minutes (0-59)
+        self.putr(7, 7)
+        m = self.minutes = bcd_7f[b]
+        self.putd(6, 0, [Ann.BIT_MINUTES, minute_labels[m]])
+
+    def handle_reg_0x02(self, b, rw, chain): # Hours (1-12+AM/PM or 0-23)
+        self.putr(7, 7)
+        self.hours, self.ampm = self.put_hours(b)
+
+    def handle_reg_0x03(self, b, rw, chain): # Day / day of week (1-7)
+        self.putr(7, 3)
+        self.days = bcd_07[b]
+        self.putd(2, 0, self.day_payloads[self.days])
+
+    def handle_reg_0x04(self, b, rw, chain): # Date (1-31)
+        self.putr(7, 6)
+        d = self.date = bcd_3f[b]
+        self.putd(5, 0, [Ann.BIT_DATE, date_labels[d]])
+
+    def handle_reg_0x05(self, b, rw, chain): # Month (1-12)
         century = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_CENTURY, ['Century overflow: %d' % century,
         'Cent OVF: %d' % century, 'CO: %d' % century, 'CO']])
-        for i in (6, 5):
-            self.putr(i)
-        m = self.months = bcd2int(b & 0x1f)
-        self.putd(4, 0, [Ann.BIT_MONTH, ['Month: %d' % m, 'Mon: %d' % m, 'M: %d' % m, 'M']])
-        self.inblock = 5 if self.inblock == 4 and self.blockmode == rw else -1
-
-    def handle_reg_0x06(self, b, rw): # Year (0-99)
-        self.putd(7, 0, [Ann.REG_YEAR, ['Year', 'Y']])
-        y = bcd2int(b & 0xff)
+        self.putr(6, 5)
+        m = self.months = bcd_1f[b]
+        self.putd(4, 0, [Ann.BIT_MONTH, month_labels[m]])
+
+    def handle_reg_0x06(self, b, rw, chain): # Year (0-99)
+        y = bcd2dec[b]
         year = y + 2000
-        self.putd(7, 0, [Ann.BIT_YEAR, ['Year: %d' % year, 'Y: %d' % y, 'Y']])
+        self.putd(7, 0, [Ann.BIT_YEAR, year_labels[y]])
         #block
-        if self.inblock == 5 and self.blockmode == rw :
-            d = 'Date / time: %s, %02d.%02d.%4d %02d:%02d:%02d%s' % (
-                days_of_week[self.options['fdw']][self.days - 1], self.date, self.months,
-                year, self.hours, self.minutes, self.seconds, self.ampm)
-            self.put(self.startreg, self.es, self.out_ann, 
-                [Ann.BLOCK_DATE_TIME, ['%s %s' % (rw, d)]])
-        self.inblock = -1
-
-    def handle_reg_0x07(self, b, rw): # Alarm1 Seconds (0-59)
-        self.putd(7, 0, [Ann.REG_ALARM1_SECONDS, ['Alarm1 Seconds', 'Al1 Sec', 'A1S']])
+        if chain:
+            d = fmt_date_time((rw, self.dow[self.days - 1], self.date,
+                self.months, year, self.hours, self.minutes, self.seconds,
+                self.ampm))
+            self.put(self.startreg, self.es, self.out_ann,
+                [Ann.BLOCK_DATE_TIME, [d]])
+
+    def handle_reg_0x07(self, b, rw, chain): # Alarm1 Seconds (0-59)
         self.a1m1 = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_A1M1, ['A1M1: %d' % self.a1m1, 'A1M1']])
-        s = self.al1seconds = bcd2int(b & 0x7f)
-        self.putd(6, 0, [Ann.BIT_SECONDS, ['Second: %d' % s, 'Sec: %d' % s, 'S: %d' % s, 'S']])
-        self.startreg = self.ss
-        self.inblock = 7
-        self.blockmode = rw 
-
-    def handle_reg_0x08(self, b, rw): # Alarm1 Minutes (0-59)
-        self.putd(7, 0, [Ann.REG_ALARM1_MINUTES, ['Alarm1 Minutes', 'Al1 Min', 'A1M']])
+        s = self.al1seconds = bcd_7f[b]
+        self.putd(6, 0, [Ann.BIT_SECONDS, second_labels[s]])
+
+    def handle_reg_0x08(self, b, rw, chain): # Alarm1 Minutes (0-59)
         self.a1m2 = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_A1M2, ['A1M2: %d' % self.a1m2, 'A1M2']])
-        m = self.al1minutes = bcd2int(b & 0x7f)
-        self.putd(6, 0, [Ann.BIT_MINUTES, ['Minute: %d' % m, 'Min: %d' % m, 'M: %d' % m, 'M']])
-        self.inblock = 8 if self.inblock == 7 and self.blockmode == rw else -1
+        m = self.al1minutes = bcd_7f[b]
+        self.putd(6, 0, [Ann.BIT_MINUTES, minute_labels[m]])
 
-    def handle_reg_0x09(self, b, rw): # Alarm1 Hours (1-12+AM/PM or 0-23)
-        self.putd(7, 0, [Ann.REG_ALARM1_HOURS, ['Alarm1 Hours', 'Al1 Hr', 'A1H']])
+    def handle_reg_0x09(self, b, rw, chain): # Alarm1 Hours (1-12+AM/PM or 0-23)
         self.a1m3 = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_A1M3, ['A1M3: %d' % self.a1m3, 'A1M3']])
-        if (b & (1 << 6)):
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['12-hour mode', '12h mode', '12h']])
-            self.a1ampm = 'PM' if (b & (1 << 5)) else 'AM'
-            self.putd(5, 5, [Ann.BIT_AM_PM, [self.a1ampm, self.a1ampm[0]]])
-            self.al1hours = bcd2int(b & 0x1f)
-            self.putd(4, 0, [Ann.BIT_HOURS, ['Hour: %d' % self.al1hours, 'H: %d' % self.al1hours, 'H']])
-        else:
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['24-hour mode', '24h mode', '24h']])
-            self.a1ampm = ''
-            self.al1hours = bcd2int(b & 0x3f)
-            self.putd(5, 0, [Ann.BIT_HOURS, ['Hour: %d' % self.al1hours, 'H: %d' % self.al1hours, 'H']])
-        self.inblock = 9 if self.inblock == 8 and self.blockmode == rw else -1
-
-    def handle_reg_0x0a(self, b, rw): # Alarm1 Date or Day / day of week (1-7)
-        self.putd(7, 0, [Ann.REG_ALARM1_DAY_DATE, ['Alarm1 Date or Day of week', 'Al1 Day / DOW', 'A1DD']])
+        self.al1hours, self.a1ampm = self.put_hours(b)
+
+    def handle_reg_0x0a(self, b, rw, chain): # Alarm1 Date or Day / day of week (1-7)
+        put, out_ann, ss, es = self.put, self.out_ann, self.ss_bits, self.es_bits
         a1m4 = 1 if (b & (1 << 7)) else 0
-        self.putd(7, 7, [Ann.BIT_A1M4, ['A1M4: %d' % a1m4, 'A1M4']])
+        put(ss[7], es[7], out_ann, [Ann.BIT_A1M4, ['A1M4: %d' % a1m4, 'A1M4']])
         a1dydt = 1 if (b & (1 << 6)) else 0
-        self.putd(6, 6, [Ann.BIT_DAY_DATE, ['DYDT: %d' % a1dydt, 'DYDT']])
-        if a1dydt == 1:        
-            w = bcd2int(b & 0x07)
-            ws = days_of_week[self.options['fdw']][w - 1]
-            self.putd(2, 0, [Ann.BIT_DAY, ['Weekday: %s' % ws, 'WD: %d' % w, 'WD', 'W']])
+        put(ss[6], es[6], out_ann, [Ann.BIT_DAY_DATE, ['DYDT: %d' % a1dydt, 'DYDT']])
+        if a1dydt == 1:
+            w = bcd_07[b]
+            ws = self.dow[w - 1]
+            put(ss[2], es[0], out_ann, self.alarm_day_payloads[w])
         else:
-            da = bcd2int(b & 0x3f)
-            self.putd(5, 0, [Ann.BIT_DATE, ['Date / Day: %d' % da, 'D: %d' % da, 'D']])
+            da = bcd_3f[b]
+            put(ss[5], es[0], out_ann, [Ann.BIT_DATE, alarm_date_labels[da]])
         #block
-        if self.inblock == 9 and self.blockmode == rw :
-            if (self.a1m1, self.a1m2, self.a1m3, a1m4) == (1, 1, 1, 1):
-                d = 'every second'
-            elif (self.a1m1, self.a1m2, self.a1m3, a1m4) == (0, 1, 1, 1):
-                d = 'every minute, second=%02d' % self.al1seconds
-            elif (self.a1m1, self.a1m2, self.a1m3, a1m4) == (0, 0, 1, 1):
-                d = 'every hour, mm:ss=%02d:%02d' % (self.al1minutes, self.al1seconds)
-            elif (self.a1m1, self.a1m2, self.a1m3, a1m4) == (0, 0, 0, 1):
-                d = 'daily, hh:mm:ss=%02d:%02d:%02d%s' % (self.al1hours, self.al1minutes, self.al1seconds, self.a1ampm)
-            elif (self.a1m1, self.a1m2, self.a1m3, a1m4) == (0, 0, 0, 0):
-                if a1dydt == 1:
-                    daydate = ws
-                else:
-                    daydate = '%d. of every month' % da
-                d = '%s, %02d:%02d:%02d' % (
-                    daydate, self.al1hours, self.al1minutes, self.al1seconds)
-            else:
-                d = 'invalid setting'  #FIXME: print warning
-            d = 'Alarm1: ' + d    
-            self.put(self.startreg, self.es, self.out_ann, 
-                [Ann.BLOCK_ALARM1, ['%s %s' % (rw, d)]])
-        self.inblock = -1
-
-    def handle_reg_0x0b(self, b, rw): # Alarm2 Minutes (0-59)
-        self.putd(7, 0, [Ann.REG_ALARM2_MINUTES, ['Alarm2 Minutes', 'Al2 Min', 'A2M']])
+        if chain:
+            daydate = ws if a1dydt else '%d. of every month' % da
+            mask = (self.a1m1 << 3) | (self.a1m2 << 2) | (self.a1m3 << 1) | a1m4
+            d = alarm1_formats.get(mask, invalid_alarm)(self.al1seconds,
+                self.al1minutes, self.al1hours, self.a1ampm, daydate)
+            put(self.startreg, self.es, out_ann,
+                [Ann.BLOCK_ALARM1, [fmt_alarm1((rw, d))]])
+
+    def handle_reg_0x0b(self, b, rw, chain): # Alarm2 Minutes (0-59)
         self.a2m2 = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_A2M2, ['A2M2: %d' % self.a2m2, 'A2M2']])
-        m = self.al2minutes = bcd2int(b & 0x7f)
-        self.putd(6, 0, [Ann.BIT_MINUTES, ['Minute: %d' % m, 'Min: %d' % m, 'M: %d' % m, 'M']])
-        self.startreg = self.ss
-        self.inblock = 0x0b
-        self.blockmode = rw 
-
-    def handle_reg_0x0c(self, b, rw): # Alarm2 Hours (1-12+AM/PM or 0-23)
-        self.putd(7, 0, [Ann.REG_ALARM2_HOURS, ['Alarm2 Hours', 'Al2 Hr', 'A2H']])
+        m = self.al2minutes = bcd_7f[b]
+        self.putd(6, 0, [Ann.BIT_MINUTES, minute_labels[m]])
+
+    def handle_reg_0x0c(self, b, rw, chain): # Alarm2 Hours (1-12+AM/PM or 0-23)
         self.a2m3 = 1 if (b & (1 << 7)) else 0
         self.putd(7, 7, [Ann.BIT_A2M3, ['A2M3: %d' % self.a2m3, 'A2M3']])
-        if (b & (1 << 6)):
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['12-hour mode', '12h mode', '12h']])
-            self.a2ampm = 'PM' if (b & (1 << 5)) else 'AM'
-            self.putd(5, 5, [Ann.BIT_AM_PM, [self.a2ampm, self.a2ampm[0]]])
-            h = self.al2hours = bcd2int(b & 0x1f)
-            self.putd(4, 0, [Ann.BIT_HOURS, ['Hour: %d' % h, 'H: %d' % h, 'H']])
-        else:
-            self.putd(6, 6, [Ann.BIT_12_24_HOURS, ['24-hour mode', '24h mode', '24h']])
-            self.a2ampm = ''
-            h = self.al2hours = bcd2int(b & 0x3f)
-            self.putd(5, 0, [Ann.BIT_HOURS, ['Hour: %d' % h, 'H: %d' % h, 'H']])
-        self.inblock = 0x0c if self.inblock == 0x0b and self.blockmode == rw else -1
-
-    def handle_reg_0x0d(self, b, rw): # Alarm2 Date or Day / day of week (1-7)
-        self.putd(7, 0, [Ann.REG_ALARM2_DAY_DATE, ['Alarm2 Date or Day of week', 'Al2 Day / DOW', 'A2DD']])
+        self.al2hours, self.a2ampm = self.put_hours(b)
+
+    def handle_reg_0x0d(self, b, rw, chain): # Alarm2 Date or Day / day of week (1-7)
+        put, out_ann, ss, es = self.put, self.out_ann, self.ss_bits, self.es_bits
         a2m4 = 1 if (b & (1 << 7)) else 0
-        self.putd(7, 7, [Ann.BIT_A2M4, ['A2M4: %d' % a2m4, 'A2M4']])
+        put(ss[7], es[7], out_ann, [Ann.BIT_A2M4, ['A2M4: %d' % a2m4, 'A2M4']])
         a2dydt = 1 if (b & (1 << 6)) else 0
-        self.putd(6, 6, [Ann.BIT_DAY_DATE, ['DYDT: %d' % a2dydt, 'DYDT']])
-        if a2dydt == 1:        
-            w = bcd2int(b & 0x07)
-            ws = days_of_week[self.options['fdw']][w - 1]
-            self.putd(2, 0, [Ann.BIT_DAY, ['Weekday: %s' % ws, 'WD: %d' % w, 'WD', 'W']])
+        put(ss[6], es[6], out_ann, [Ann.BIT_DAY_DATE, ['DYDT: %d' % a2dydt, 'DYDT']])
+        if a2dydt == 1:
+            w = bcd_07[b]
+            ws = self.dow[w - 1]
+            put(ss[2], es[0], out_ann, self.alarm_day_payloads[w])
         else:
-            da = bcd2int(b & 0x3f)
-            self.putd(5, 0, [Ann.BIT_DATE, ['Date / Date: %d' % da, 'D: %d' % da, 'D']])
+            da = bcd_3f[b]
+            put(ss[5], es[0], out_ann, [Ann.BIT_DATE, alarm_date_labels[da]])
         #block
-        if self.inblock == 0x0c and self.blockmode == rw :
-            if (self.a2m2, self.a2m3, a2m4) == (1, 1, 1):
-                d = 'every minute'
-            elif (self.a2m2, self.a2m3, a2m4) == (0, 1, 1):
-                d = 'every hour, minute=%02d' % self.al2minutes
-            elif (self.a2m2, self.a2m3, a2m4) == (0, 0, 1):
-                d = 'every day, hh:mm=%02d:%02d%s' % (self.al2hours, self.al2minutes, self.a2ampm)
-            elif (self.a2m2, self.a2m3, a2m4) == (0, 0, 0):
-                if a2dydt == 1:
-                    daydate = ws     
-                else:
-                    daydate = '%d. of month' % da
-                d = 'every %s, hh:mm=%02d:%02d' % (
-                    daydate, self.al2hours, self.al2minutes)
-            else:
-                d = 'invalid setting'  #FIXME: print warning
-            d = 'Alarm2: ' + d    
-            self.put(self.startreg, self.es, self.out_ann, 
-                [Ann.BLOCK_ALARM2, ['%s %s' % (rw, d)]])
-        self.inblock = -1
-
-    def handle_reg_0x0e(self, b, rw): # Control Register
-        self.putd(7, 0, [Ann.REG_CONTROL, ['Control', 'Ctrl', 'C']])
-        eosc = 1 if (b & (1 << 7)) else 0
-        bbsqw = 1 if (b & (1 << 6)) else 0
-        bbsqw2 = 'en' if (b & (1 << 6)) else 'dis'
-        conv = 1 if (b & (1 << 5)) else 0
-        intcn2 = 'alarm interrupt' if (b & (1 << 5)) else 'square wave'
-        intcn = 1 if (b & (1 << 2)) else 0
-        a2ie = 1 if (b & (1 << 1)) else 0
-        a2ie2 = 'en' if (b & (1 << 1)) else 'dis'
-        a1ie = 1 if (b & 1) else 0
-        a1ie2 = 'en' if (b & 1) else 'dis'
-        self.putd(7, 7, [Ann.BIT__EOSC, ['Enable oscillator: %d' % eosc,
-            'enab osc: %d' % eosc, 'EO: %d' % eosc, 'EO']])
-        self.putd(6, 6, [Ann.BIT_BBSQWE, ['Battery backed square wave %sabled' % bbsqw2,
-            'BBSQWE: %sabled' % bbsqw2, 'SQWE: %d' % bbsqw, 'S: %d' % bbsqw, 'S']])
-        self.putd(5, 5, [Ann.BIT_CONV, ['Forced temperature conversion: %d' % conv,
-            'frc tconv: %d' % conv, 'FC: %d' % conv, 'FC']])
-        if self.options['subtype'] == 'SN':  # bit 4 and 3 are reserved for DS3231M
-            r = rates[((b >> 3) & 0x03)]
-            self.putd(4, 3, [Ann.BIT_RATE, ['Square wave output rate: %s' % r,
-                'Square wave rate: %s' % r, 'SQW rate: %s' % r, 'Rate: %s' % r,
-                'RA: %s' % r, 'RA', 'R']])
-        else:
-            self.putr(4)
-            self.putr(3)
-        self.putd(2, 2, [Ann.BIT_INTCN, ['Int/SQW pin: %s' % intcn2,
-            'Int on pin: %d' % intcn, 'IP: %d' % intcn, 'IP']])    
-        self.putd(1, 1, [Ann.BIT_A2IE, ['Alarm2 interrupt %sabled' % a2ie2,
-            'Al2 INT %sabled' % a2ie2, 'Al2 INT: %d' % a2ie, 'A2I: %d' % a2ie, 'A2I']])
-        self.putd(0, 0, [Ann.BIT_A1IE, ['Alarm1 interrupt %sabled' % a1ie2,
-            'Al1 INT %sabled' % a1ie2, 'Al1 INT: %d' % a1ie, 'A1I: %d' % a1ie, 'A1I']])
-        #FIXME: add block output    
-
-    def handle_reg_0x0f(self, b, rw): # Control / Status Register
-        self.putd(7, 0, [Ann.REG_CONTROL_STATUS, ['Control / Status', 'Ctrl/Stat', 'C/S']])
-        for i in (6, 5, 4):
-            self.putr(i)
-        osf = 1 if (b & (1 << 7)) else 0
-        en32 = 1 if (b & (1 << 3)) else 0
-        bsy = 1 if (b & (1 << 2)) else 0
-        a2f = 1 if (b & (1 << 1)) else 0
-        a1f = 1 if (b & 1) else 0
-        self.putd(7, 7, [Ann.BIT_OSF, ['Oscillator stop flag: %d' % osf,
-            'Osc stop: %d' % osf, 'OS: %d' % osf, 'OS']])
-        self.putd(3, 3, [Ann.BIT_EN32KHZ, ['Enable 32kHz output: %d' % en32,
-            'En 32k out: %d' % en32, '32k: %d' % en32, '32k']])
-        #FIXME: also for model M?
-        self.putd(2, 2, [Ann.BIT_BSY, ['Busy TXCO: %d' % bsy,
-            'TXCO: %d' % bsy, 'TX: %d' % bsy, 'TX']])
-        self.putd(1, 1, [Ann.BIT_A2F, ['Alarm2 flag: %d' % a2f,
-            'Al2 flg: %d' % a2f, 'A2F: %d' % a2f, 'A2']])
-        self.putd(0, 0, [Ann.BIT_A1F, ['Alarm1 flag: %d' % a1f,
-            'Al1 flg: %d' % a1f, 'A1F: %d' % a1f, 'A1']])
-        #FIXME: add block output        
-
-    def handle_reg_0x10(self, b, rw): # Aging / Offset Register
-        self.putd(7, 0, [Ann.REG_AGING_OFFSET, ['Aging offset', 'Aging', 'A']])
-        ao = b if b < 128 else b - 256 # signed 2's complement
+        if chain:
+            daydate = ws if a2dydt else '%d. of month' % da
+            mask = (self.a2m2 << 2) | (self.a2m3 << 1) | a2m4
+            d = alarm2_formats.get(mask, invalid_alarm)(
+                self.al2minutes, self.al2hours, self.a2ampm, daydate)
+            put(self.startreg, self.es, out_ann,
+                [Ann.BLOCK_ALARM2, [fmt_alarm2((rw, d))]])
+
+    def put_flags(self, b, flags):
+        put, out_ann, ss, es = self.put, self.out_ann, self.ss_bits, self.es_bits
+        for bit, payloads in flags:
+            put(ss[bit], es[bit], out_ann, payloads[(b >> bit) & 1])
+
+    def handle_reg_0x0e(self, b, rw, chain): # Control Register (DS3231SN)
+        self.put_flags(b, control_flags_hi)
+        self.putd(4, 3, rate_payloads[(b >> 3) & 0x03])
+        self.put_flags(b, control_flags_lo)
+        #FIXME: add block output
+
+    def handle_reg_0x0e_m(self, b, rw, chain): # Control Register (DS3231M)
+        self.put_flags(b, control_flags_hi)
+        self.putr(4, 3)  # bit 4 and 3 are reserved for DS3231M
+        self.put_flags(b, control_flags_lo)
+        #FIXME: add block output
+
+    def handle_reg_0x0f(self, b, rw, chain): # Control / Status Register
+        self.putr(6, 4)
+        #FIXME: BSY also for model M?
+        self.put_flags(b, status_flags)
+        #FIXME: add block output
+
+    def handle_reg_0x10(self, b, rw, chain): # Aging / Offset Register
+        ao = (b ^ 0x80) - 0x80 # signed 2's complement
         self.putd(7, 0, [Ann.BIT_AOFS, ['Offset: %d' % ao, 'Ofs: %d' % ao, 'O: %d' % ao, 'O']])
 
-    def handle_reg_0x11(self, b, rw): # MSB of Temperature Register
-        self.putd(7, 0, [Ann.REG_TEMPERATURE_MSB, ['Temperature MSB', 'tm', 't']])
+    def handle_reg_0x11(self, b, rw, chain): # MSB of Temperature Register
         self.tempMSB = b
-        tm = b if b < 128 else b - 256  
+        tm = (b ^ 0x80) - 0x80
         self.putd(7, 0, [Ann.BIT_TMSB, ['tempMSB: %d' % tm, 'tm: %d' % tm, 'tm: %d' % tm, 't']])
-        self.startreg = self.ss
-        self.inblock = 0x11
 
-    def handle_reg_0x12(self, b, rw): # LSB of Temperature Register
-        self.putd(7, 0, [Ann.REG_TEMPERATURE_LSB, ['Temperature LSB', 'tl', 't']])
-        for i in range(6): self.putr(i)
+    def handle_reg_0x12(self, b, rw, chain): # LSB of Temperature Register
+        self.putr(5, 0)
         tl = b >> 6
         self.putd(7, 6, [Ann.BIT_TLSB, ['tempLSB: %d' % tl, 'tl: %d' % tl, 'tl: %d' % tl, 't']])
         #block
-        if self.inblock == 0x11:
-            theta = (self.tempMSB << 2) + tl
-            if theta >= 512: theta = theta - 1024 
-            d = 'Temperature: %.2f' % ( theta / 4 )
-            self.put(self.startreg, self.es, self.out_ann, 
-                [Ann.BLOCK_TEMPERATURE, ['%s block data: %s' % (rw, d)]])
-        self.inblock = -1
+        if chain:
+            theta = (((self.tempMSB << 2) + tl) ^ 0x200) - 0x200 # signed 10 bit
+            self.put(self.startreg, self.es, self.out_ann,
+                [Ann.BLOCK_TEMPERATURE, [fmt_temperature((rw, theta / 4))]])
 
     def handle_reg(self, b, rw):
-        #print('reg:%s - block%x' % (self.reg, self.inblock))
+        #print('reg:%s - next:%x' % (self.reg, self.nextreg))
         #FIXME: catch out of range register, write warning
-        if self.reg not in range(0,0x13):
+        reg = self.reg
+        if not 0 <= reg <= 0x12:
             self.put(self.ss, self.es, self.out_ann,
-                 [Ann.WARNING, ['Ignoring out-of-range register 0x%02X' % self.reg]])
+                 [Ann.WARNING, ['Ignoring out-of-range register 0x%02X' % reg]])
             return
-        fn = getattr(self, 'handle_reg_0x%02x' % self.reg)
-        fn(b, rw)
+        # A block (date/time, alarms, temperature) is decoded only if all
+        # of its registers are accessed in sequence in the same direction.
+        if reg in block_start_regs:
+            self.startreg = self.ss
+            self.blockmode = rw
+            chain = True
+        else:
+            chain = reg == self.nextreg and rw == self.blockmode
+        self.putd(7, 0, reg_payloads[reg])
+        self.handlers[reg](b, rw, chain)
+        self.nextreg = reg_inc[reg] if chain else -1
         # Honor address auto-increment feature of the DS3231. When the
         # address reaches 0x12, it will wrap around to address 0.
-        self.reg += 1
-        if self.reg > 0x12:
-            self.reg = 0
+        self.reg = reg_inc[reg]
 
     def is_correct_chip(self, addr):
         if addr == DS3231_I2C_ADDRESS:
@@ -469,56 +516,51 @@ class Decoder(srd.Decoder):
                  [Ann.WARNING, ['Ignoring non-DS3231 data (slave 0x%02X)' % addr]])
         return False
 
+    # State machine: each handler takes the packet's data byte and
+    # moves on to the next state.
+
+    def on_start(self, databyte):
+        # I²C START (or Repeated Start): an address follows.
+        self.state = 'GET SLAVE ADDR'
+
+    def on_address_write(self, databyte):
+        # Address write operation: the register pointer follows.
+        self.state = 'GET REG ADDR' if self.is_correct_chip(databyte) else 'IDLE'
+
+    def on_address_read(self, databyte):
+        # Address read operation: register contents follow.
+        self.state = 'READ RTC REGS' if self.is_correct_chip(databyte) else 'IDLE'
+
+    def on_reg_addr(self, databyte):
+        # Data write (master selects the slave register).
+        self.reg = databyte  #start register for read/write
+        self.state = 'WRITE RTC REGS'
+
+    def on_data_write(self, databyte):
+        self.handle_reg(databyte, 'Wrote')
+
+    def on_data_read(self, databyte):
+        self.handle_reg(databyte, 'Read')
+
+    def on_stop(self, databyte):
+        self.state = 'IDLE'
+
     def decode(self, ss, es, data):
         cmd, databyte = data
 
-        # Collect the 'BITS' packet, then return. The next packet is
-        # guaranteed to belong to these bits we just stored.
+        # Collect the start/end samples of the 'BITS' packet, then return.
+        # The next packet is guaranteed to belong to these bits.
         if cmd == 'BITS':
-            self.bits = databyte
+            self.ss_bits = [bit[1] for bit in databyte]
+            self.es_bits = [bit[2] for bit in databyte]
             return
 
-        # Store the start/end samples of this I²C packet.
-        self.ss, self.es = ss, es
-
         #print('%s - %s' % (self.state, cmd))
 
-        # State machine.
-        if self.state == 'IDLE':
-            # Wait for an I²C START condition.
-            if cmd == 'START':
-                self.state = 'GET SLAVE ADDR'
-        elif self.state == 'GET SLAVE ADDR':
-            # Wait for an address write operation.
-            if cmd == 'ADDRESS WRITE':
-                if self.is_correct_chip(databyte):
-                    self.state = 'GET REG ADDR'
-                else:    
-                    self.state = 'IDLE'
-            # Wait for an address read operation.
-            elif cmd == 'ADDRESS READ':
-                if self.is_correct_chip(databyte):
-                    self.state = 'READ RTC REGS'
-                else:    
-                    self.state = 'IDLE'
-        elif self.state == 'GET REG ADDR':
-            # Wait for a data write (master selects the slave register).
-            if cmd == 'DATA WRITE':
-                self.reg = databyte  #start register for read/write
-                self.state = 'WRITE RTC REGS'
-            elif cmd == 'STOP':
-                self.state = 'IDLE'
-        elif self.state == 'WRITE RTC REGS':
-            # If we see a Repeated Start here, it's an RTC read.
-            if cmd == 'START REPEAT':
-                self.state = 'GET SLAVE ADDR'
-            # Otherwise: Get data bytes until a STOP condition occurs.
-            elif cmd == 'DATA WRITE':
-                self.handle_reg(databyte, 'Wrote')
-            elif cmd == 'STOP':
-                self.state = 'IDLE'
-        elif self.state == 'READ RTC REGS':
-            if cmd == 'DATA READ':
-                self.handle_reg(databyte, 'Read')
-            elif cmd == 'STOP':
-                self.state = 'IDLE'
+        # State machine: packets without a transition (ACK, NACK, ...)
+        # are ignored without touching any decoder state.
+        fn = self.fsm.get((self.state, cmd))
+        if fn:
+            # Store the start/end samples of this I²C packet.
+            self.ss, self.es = ss, es
+            fn(databyte)